@@ -1,28 +1,54 @@
 
 import os
+import re
 import sys
-import json
 import argparse
-import time
-import requests
+import asyncio
+import httpx
+import orjson
+from pathlib import Path
+from itertools import chain
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
+# pandas is optional: only used for the vectorized filter path on big batches
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
 # Load environment variables
 load_dotenv()
 
 APIFY_API_TOKEN = os.getenv("APIFY_API_TOKEN")
 ACTOR_ID = "upwork-vibe~upwork-job-scraper"
 
-def scrape_jobs(limit, days_back, search_queries=None):
+# Shared pooled client: HTTP/2 + keep-alive means run starts, long-polls and
+# dataset fetches all reuse one TLS session instead of handshaking per call.
+# Token lives in the Authorization header, not in query strings / logs.
+_HTTP = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=16),
+    headers={"Authorization": f"Bearer {APIFY_API_TOKEN}"},
+)
+
+# URL templates built once; per-call code only fills in the run/dataset id.
+# Token-free URLs stay safe to print and to write into .tmp/error.log.
+_ACTOR_RUN_URL = f"https://api.apify.com/v2/acts/{ACTOR_ID}/runs?waitForFinish=120"
+_RUN_STATUS_URL = "https://api.apify.com/v2/actor-runs/{run_id}?waitForFinish=120"
+_DATASET_ITEMS_URL = "https://api.apify.com/v2/datasets/{dataset_id}/items?format=jsonl&clean=true"
+
+async def scrape_jobs(client, sem, limit, days_back, query):
     """
-    Runs the Apify actor to scrape Upwork jobs.
+    Runs the Apify actor to scrape Upwork jobs for a single search query.
+    Async so the poll loop yields to the event loop instead of blocking the process.
+    Concurrent actor starts are gated by the semaphore to stay under Apify limits.
     """
     if not APIFY_API_TOKEN:
         raise ValueError("APIFY_API_TOKEN not found in .env")
 
-    url = f"https://api.apify.com/v2/acts/{ACTOR_ID}/runs?token={APIFY_API_TOKEN}"
-    
+
     # Calculate creation time filter if days_back is provided
     # Note: The actor might not support date filtering directly in input efficiently for all fields,
     # but we will pass what we can or filter post-scrape if needed.
@@ -37,31 +63,27 @@ def scrape_jobs(limit, days_back, search_queries=None):
     # Checking actor docs (assumed): usually accepts 'publication_time' or similar. 
     # Directive says "fromDate", "toDate".
     
-    queries = [q.strip() for q in search_queries.split(",")] if search_queries else ["workflow automation"]
-    
     # Reverting to 'upwork-vibe/upwork-job-scraper' with FLATTENED keys.
     # Analysis of successful run shows keys like "includeKeywords.matchTitle".
     # Nested objects caused 400 "Property not allowed".
-    
-    # We must iterate if we have multiple queries because 'keywords' field implies AND logic usually, 
-    # but let's pass all as a list first. The user wants "OR" likely, but standard search is often AND.
-    # Actually, Upwork search supports boolean "OR". But here we have a list.
-    # We'll pass them as a list. If results are scant, we might need to loop.
-    
+
+    # One query per run now: passing the whole list made 'keywords' behave like AND.
+    # Running per-query and merging gives us the OR semantics we actually want.
+
     run_input = {
         "limit": limit,
         "fromDate": from_date.strftime("%Y-%m-%d"),
         "toDate": now.strftime("%Y-%m-%d"),
         # Flattened keys
-        "includeKeywords.keywords": queries,
+        "includeKeywords.keywords": [query],
         "includeKeywords.matchTitle": True,
         "includeKeywords.matchDescription": True,
         "includeKeywords.matchSkills": True,
         # Adding sort by recency if possible? Schema didn't show it.
         # User had "jobCategories" in their successful run. We'll omit for now to keep it broad.
     }
-    
-    print(f"Starting Apify actor run (upwork-vibe/upwork-job-scraper) with input: {json.dumps(run_input)}")
+
+    print(f"Starting Apify actor run (upwork-vibe/upwork-job-scraper) with input: {orjson.dumps(run_input).decode()}")
     
     # Retry Logic for starting the run
     max_retries = 3
@@ -72,11 +94,16 @@ def scrape_jobs(limit, days_back, search_queries=None):
         for attempt in range(max_retries):
             try:
                 # upwork-vibe/upwork-job-scraper
-                actor_url = f"https://api.apify.com/v2/acts/upwork-vibe~upwork-job-scraper/runs?token={APIFY_API_TOKEN}"
-                response = requests.post(actor_url, json=run_input)
+                # waitForFinish long-polls: POST only returns once the run
+                # finishes (or 120s elapses), so no 5s poll loop needed.
+                # Timeout must outlast the 120s server-side wait; a read
+                # timeout here can't be retried (re-POSTing starts a
+                # duplicate run).
+                async with sem:
+                    response = await client.post(_ACTOR_RUN_URL, json=run_input, timeout=150)
                 response.raise_for_status()
                 break
-            except requests.exceptions.HTTPError as e:
+            except httpx.HTTPStatusError as e:
                 print(f"HTTP Error {e.response.status_code}. Writing details to .tmp/error.log")
                 try:
                     with open(".tmp/error.log", "w", encoding="utf-8") as f:
@@ -93,137 +120,206 @@ def scrape_jobs(limit, days_back, search_queries=None):
                 print(f"Error starting run (Attempt {attempt+1}/{max_retries}): {e}")
                 if attempt == max_retries - 1:
                     raise e
-                time.sleep(2 * (attempt + 1))
+                await asyncio.sleep(2 * (attempt + 1))
         
         run_data = response.json().get("data", {})
         run_id = run_data.get("id")
         dataset_id = run_data.get("defaultDatasetId")
-        
-        print(f"Run started: {run_id}")
-        
-        # Poll for completion
-        while True:
+        status = run_data.get("status")
+
+        print(f"Run started: {run_id} (status after waitForFinish: {status})")
+
+        # If the run outlived the POST's waitForFinish window, long-poll the
+        # run endpoint. Each GET blocks server-side up to 120s, so this is
+        # 1-2 requests total instead of one every 5 seconds.
+        max_waits = 10  # hard cap: ~20 minutes of actor runtime
+        waits = 0
+        while status not in ["SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"]:
+            if waits >= max_waits:
+                raise Exception(f"Run {run_id} still {status} after {max_waits} waits; giving up")
+            waits += 1
             try:
-                status_url = f"https://api.apify.com/v2/actor-runs/{run_id}?token={APIFY_API_TOKEN}"
-                status_res = requests.get(status_url)
-                status_data = status_res.json().get("data", {})
-                status = status_data.get("status")
-                
+                status_url = _RUN_STATUS_URL.format(run_id=run_id)
+                status_res = await client.get(status_url, timeout=150)
+                status = status_res.json().get("data", {}).get("status")
                 print(f"Status: {status}")
-                
-                if status in ["SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"]:
-                    break
-                    
-                time.sleep(5)
             except Exception as e:
-                print(f"Polling error: {e}. Retrying poll...")
-                time.sleep(5)
-            
+                print(f"Wait-for-finish error: {e}. Retrying...")
+                await asyncio.sleep(5)
+
+
         if status != "SUCCEEDED":
             raise Exception(f"Run failed/aborted with status: {status}")
             
-        # Fetch results
-        dataset_url = f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={APIFY_API_TOKEN}&format=json"
+        # Fetch results as jsonl and parse line-by-line: never buffers the
+        # whole dataset body, and orjson parses each row straight from bytes.
+        dataset_url = _DATASET_ITEMS_URL.format(dataset_id=dataset_id)
         for attempt in range(max_retries):
             try:
-                dataset_res = requests.get(dataset_url)
-                dataset_res.raise_for_status()
-                return dataset_res.json()
+                items = []
+                async with client.stream("GET", dataset_url) as dataset_res:
+                    dataset_res.raise_for_status()
+                    async for line in dataset_res.aiter_lines():
+                        if line.strip():
+                            items.append(orjson.loads(line))
+                return items
             except Exception as e:
                  print(f"Error fetching dataset (Attempt {attempt+1}): {e}")
                  if attempt == max_retries - 1:
                      raise e
-                 time.sleep(2)
+                 await asyncio.sleep(2)
                  
     except Exception as glob_e:
         print(f"Fatal error during scraping: {glob_e}")
         # If we failed, return empty list or re-raise
         raise glob_e
 
+# High proposal-count buckets we always reject (compiled once, not per job)
+REJECT_PROPOSALS_RE = re.compile(r"15 to 20|20 to 50|50\+")
+
+# Below this many jobs the pandas setup cost outweighs the per-row savings
+VECTORIZE_THRESHOLD = 1000
+
+def filter_jobs_vectorized(jobs, verified_payment, min_spent, experience_levels, days_back):
+    """
+    Columnar twin of filter_jobs for large batches: flattens the jobs into
+    a DataFrame once and applies every criterion as a boolean mask, so the
+    per-row work happens in C instead of the interpreter loop.
+    Returns the surviving original job dicts (so transform_job is unchanged).
+    Any schema surprise raises and the caller falls back to filter_jobs.
+    """
+    df = pd.json_normalize(jobs, max_level=2)
+    mask = pd.Series(True, index=df.index)
+
+    def col(name, default=None):
+        # json_normalize drops columns absent from every row; synthesize them
+        if name in df.columns:
+            return df[name]
+        return pd.Series(default, index=df.index)
+
+    def falsy(series):
+        # Row-wise truthiness: None, NaN, 0, "" all count as missing,
+        # exactly like `job.get(...) or fallback` does in filter_jobs.
+        return series.map(lambda v: v is None or (isinstance(v, float) and v != v) or not v)
+
+    def or_col(primary, secondary):
+        # Vector version of the row-wise `a or b` fallback (combine_first
+        # only falls back on NaN, which is subtly stricter).
+        return primary.where(~falsy(primary), secondary)
+
+    # 1. Proposal Count
+    proposals = or_col(col("proposals"), col("proposalCount"))
+    mask &= ~proposals.fillna("").astype(str).str.contains(REJECT_PROPOSALS_RE)
+    # Numeric gate mirrors the row-wise isinstance check: only values that
+    # are actually ints/floats get compared, numeric *strings* pass.
+    numeric = proposals.map(lambda v: float(v) if isinstance(v, (int, float)) else float("nan"))
+    mask &= ~(numeric >= 15)
+
+    # 2. Experience Level (only filters rows where a level is present,
+    # matching the row-wise behaviour; empty strings pass too)
+    if experience_levels:
+        permitted = frozenset(l.strip().lower() for l in experience_levels)
+        level = or_col(col("experienceLevel"), col("vendor.experienceLevel"))
+        mask &= falsy(level) | level.fillna("").astype(str).str.lower().isin(permitted)
+
+    # 3. Verified Payment
+    if verified_payment:
+        mask &= (
+            col("isPaymentVerified", False).fillna(False).astype(bool)
+            | (col("client.paymentMethodVerified").fillna(False) == True)
+            | (col("client.paymentVerificationStatus").fillna("") == "VERIFIED")
+        )
+
+    # 4. Min Spent
+    if min_spent > 0:
+        spent = col("client.totalSpent").combine_first(col("client.stats.totalSpent"))
+        spent = pd.to_numeric(
+            spent.fillna(0).astype(str).str.replace(",", "").str.replace("$", "", regex=False),
+            errors="coerce",
+        ).fillna(0)
+        mask &= spent >= min_spent
+
+    # Hand back original dicts so downstream stays schema-tolerant
+    return [jobs[i] for i in df.index[mask]]
+
 def filter_jobs(jobs, verified_payment, min_spent, experience_levels, days_back):
     """
     Filters jobs based on criteria.
+    Accepts any iterable and yields matches, so callers can stream jobs
+    through without materializing the full list first.
+    Checks run cheapest-first so a doomed job never pays for the float
+    parse at the end.
     """
-    filtered = []
-    
     now = datetime.now(timezone.utc)
     cutoff_time = now - timedelta(days=days_back)
-    
-    print(f"Filtering {len(jobs)} jobs...")
-    
-    if jobs:
-        print(f"DEBUG: First Job Client Data: {jobs[0].get('client')}")
+
+    # Hoisted out of the loop: normalized once, O(1) membership per job.
+    permitted = frozenset(l.strip().lower() for l in experience_levels) if experience_levels else None
+
+    seen_first = False
 
     for job in jobs:
-        # 1. Posted time check
-        # Apify usually returns 'postedDate' or 'date_created'
-        posted_date_str = job.get("postedDate") or job.get("date_created") or job.get("createdAt")
-        
-        # Parse logic depends on actual format. Assuming ISO for now.
-        # If scraper returns '2h ago' type strings, we might need parsing logic. 
-        # But 'upwork-job-scraper' usually gives ISO strings.
-        
-        # Skip time check if we can't parse, or handle gracefully.
-        # For now, relying on Apify's fromDate input to handle the bulk of date filtering.
-        
-        # 2. Verified Payment
+        if not seen_first:
+            print(f"DEBUG: First Job Client Data: {job.get('client')}")
+            seen_first = True
+
+        # Posted time check: relying on Apify's fromDate input to handle
+        # the bulk of date filtering (scraper usually gives ISO strings).
+
+        # 1. Proposal Count (cheapest check: regex over a short string)
+        # Schema analysis shows 'proposals' might be missing.
+        proposals = job.get("proposals") or job.get("proposalCount")
+
+        if proposals:
+             # Strict filtering: Reject high proposal buckets
+             if REJECT_PROPOSALS_RE.search(str(proposals)):
+                 continue
+             if isinstance(proposals, (int, float)) and proposals >= 15:
+                 continue
+
+        # 2. Experience Level
+        # Schema analysis shows 'experienceLevel' might be in 'vendor' object
+        job_level = job.get("experienceLevel") or job.get("vendor", {}).get("experienceLevel")
+
+        if permitted and job_level:
+            if job_level.lower() not in permitted:
+                # print(f"Rejected {job.get('uid')} - Level: {job_level}")
+                continue
+
+        # 3. Verified Payment
         if verified_payment:
             client = job.get("client", {})
             # Schema analysis shows 'paymentMethodVerified' is a boolean in 'client' output
             # Previous logic checked for string 'VERIFIED' which caused rejection.
             is_verified = job.get("isPaymentVerified") or client.get("paymentMethodVerified") is True or client.get("paymentVerificationStatus") == "VERIFIED"
-            
+
             if not is_verified:
                 # print(f"Rejected {job.get('uid')} - Payment not verified")
                 continue
 
-        # 3. Min Spent
+        # 4. Min Spent (most expensive: string cleanup + float parse)
         if min_spent > 0:
             client = job.get("client", {})
             total_spent = client.get("totalSpent")
             # Schema analysis shows 'totalSpent' inside 'stats' object
             if total_spent is None and "stats" in client:
                 total_spent = client.get("stats", {}).get("totalSpent")
-            
+
             total_spent = total_spent or 0
-            
+
             # Ensure it's a number
             try:
                 total_spent = float(str(total_spent).replace(",", "").replace("$", ""))
             except:
                 total_spent = 0
-                
+
             if total_spent < min_spent:
                 # print(f"Rejected {job.get('uid')} - Low Spend: {total_spent}")
                 continue
-                
-        # 4. Experience Level
-        # Schema analysis shows 'experienceLevel' might be in 'vendor' object
-        job_level = job.get("experienceLevel") or job.get("vendor", {}).get("experienceLevel")
-        
-        if experience_levels and job_level:
-            permitted = [l.strip().lower() for l in experience_levels]
-            if job_level.lower() not in permitted:
-                # print(f"Rejected {job.get('uid')} - Level: {job_level}")
-                continue
-                
+
         # 5. Connects (Optional - verify later)
-        
-        # 6. Proposal Count
-        # Schema analysis shows 'proposals' might be missing.
-        proposals = job.get("proposals") or job.get("proposalCount")
-        
-        if proposals:
-             # Strict filtering: Reject high proposal buckets
-             reject_phrases = ["15 to 20", "20 to 50", "50+"]
-             if any(phrase in str(proposals) for phrase in reject_phrases):
-                 continue
-             if isinstance(proposals, (int, float)) and proposals >= 15:
-                 continue
-                 
-        filtered.append(job)
-        
-    return filtered
+
+        yield job
 
 def transform_job(job):
     """
@@ -266,6 +362,99 @@ def transform_job(job):
         "apply_url": apply_url,
     }
 
+# Specialized transform for the known upwork-vibe actor schema: generated
+# once at import as a straight-line dict build with no fallback chains, so
+# the hot loop skips the redundant .get() cascades. Expressions assume the
+# keys below; pick_transform only selects this path when they're present.
+_FAST_FIELDS = [
+    ("title", "j.get('title')"),
+    ("description", "j.get('description')"),
+    ("skills", "j.get('skills', [])"),
+    ("budget", "j.get('budget')"),
+    ("hourly_rate", "j.get('hourlyRate')"),
+    ("job_type", "j.get('jobType')"),
+    ("experience_level", "j.get('experienceLevel')"),
+    ("client_country", "c.get('location', {}).get('country')"),
+    ("client_total_spent", "s.get('totalSpent')"),
+    ("client_hires", "s.get('totalHires')"),
+    ("proposal_count", "j.get('proposals')"),
+    ("posted_date", "j.get('postedDate')"),
+    ("job_url", "j.get('url')"),
+]
+
+def _build_fast_transform():
+    entries = ["'job_id': jid"]
+    entries += [f"{key!r}: {expr}" for key, expr in _FAST_FIELDS]
+    entries.append("'apply_url': f'https://www.upwork.com/nx/proposals/job/{jid}/apply/' if jid else ''")
+    src = (
+        "def _transform_fast(j):\n"
+        "    c = j.get('client', {})\n"
+        "    s = c.get('stats', {})\n"
+        "    jid = j.get('id') or j.get('ciphertext')\n"
+        "    return {" + ", ".join(entries) + "}\n"
+    )
+    namespace = {}
+    exec(compile(src, "<generated transform>", "exec"), namespace)
+    return namespace["_transform_fast"]
+
+_transform_fast = _build_fast_transform()
+
+# Keys the fast path takes for granted
+_FAST_SCHEMA_KEYS = ("title", "postedDate", "url")
+
+def pick_transform(sample_job):
+    """
+    Chooses the specialized transform when the first job matches the known
+    actor schema; any drift keeps us on the generic fallback-chain version.
+    """
+    if (
+        sample_job
+        and all(k in sample_job for k in _FAST_SCHEMA_KEYS)
+        and "stats" in sample_job.get("client", {})
+    ):
+        return _transform_fast
+    return transform_job
+
+async def main_async(args):
+    """
+    Async entry point: one actor run per query, all in flight at once.
+    Concurrency is capped by APIFY_CONCURRENCY (default 5) so we don't
+    slam the actor with a long query list.
+    """
+    queries = [q.strip() for q in args.search_queries.split(",")] if args.search_queries else ["workflow automation"]
+    sem = asyncio.Semaphore(int(os.getenv("APIFY_CONCURRENCY", "5")))
+
+    tasks = [scrape_jobs(_HTTP, sem, args.limit, args.days, q) for q in queries]
+    try:
+        # return_exceptions: one failed query must not abort its siblings
+        # mid-flight (or leave them racing a closed client at shutdown).
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await _HTTP.aclose()
+
+    job_lists = []
+    for q, res in zip(queries, results):
+        if isinstance(res, BaseException):
+            print(f"Query '{q}' failed: {res}")
+        else:
+            job_lists.append(res)
+
+    if not job_lists:
+        raise Exception("All queries failed to scrape")
+
+    # Merge and dedupe: the same job can match several queries.
+    seen = set()
+    merged = []
+    for job in chain.from_iterable(job_lists):
+        key = job.get("id") or job.get("ciphertext")
+        if key and key in seen:
+            continue
+        if key:
+            seen.add(key)
+        merged.append(job)
+
+    return merged
+
 def main():
     parser = argparse.ArgumentParser(description="Scrape and filter Upwork jobs.")
     parser.add_argument("--search-queries", type=str, default="workflow automation", help="Comma-separated search queries")
@@ -277,10 +466,15 @@ def main():
     parser.add_argument("-o", "--output", required=True, help="Output JSON file path")
     
     args = parser.parse_args()
-    
+
+    # Create output dirs once up front. .tmp must exist before any error.log
+    # write, which used to fail silently when it was missing.
+    Path(".tmp").mkdir(exist_ok=True)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+
     print(f"Fetching jobs from Upwork for query: '{args.search_queries}'...")
     try:
-        raw_jobs = scrape_jobs(args.limit, args.days, args.search_queries)
+        raw_jobs = asyncio.run(main_async(args))
     except Exception as e:
         print(f"Error scraping: {e}")
         sys.exit(1)
@@ -290,23 +484,29 @@ def main():
     # Process experience levels
     exp_levels = args.experience.split(",") if args.experience else []
     
-    filtered = filter_jobs(raw_jobs, args.verified_payment, args.min_spent, exp_levels, args.days)
-    
-    print(f"Filtered down to {len(filtered)} jobs.")
-    
-    if filtered:
-        print("DEBUG: Raw keys of first job:", list(filtered[0].keys()))
-    
-    # Transform
-    output_data = [transform_job(j) for j in filtered]
+    print(f"Filtering {len(raw_jobs)} jobs...")
+
+    # Big batches go through the vectorized path when pandas is available;
+    # anything else (or schema drift) uses the row-wise generator.
+    filtered = None
+    if pd is not None and len(raw_jobs) >= VECTORIZE_THRESHOLD:
+        try:
+            filtered = filter_jobs_vectorized(raw_jobs, args.verified_payment, args.min_spent, exp_levels, args.days)
+        except Exception as e:
+            print(f"Vectorized filter failed ({e}); falling back to row-wise filter.")
+
+    if filtered is None:
+        filtered = filter_jobs(raw_jobs, args.verified_payment, args.min_spent, exp_levels, args.days)
+
+    transform = pick_transform(raw_jobs[0]) if raw_jobs else transform_job
+    output_data = [transform(j) for j in filtered]
+
+    print(f"Filtered down to {len(output_data)} jobs.")
     
     # Save
-    output_dir = os.path.dirname(args.output)
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        
-    with open(args.output, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    # orjson writes UTF-8 bytes directly (no ensure_ascii pass needed)
+    with open(args.output, "wb") as f:
+        f.write(orjson.dumps(output_data, option=orjson.OPT_INDENT_2))
         
     print(f"Saved to {args.output}")
 
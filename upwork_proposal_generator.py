@@ -1,19 +1,25 @@
 
 import os
-import json
+import orjson
 import argparse
+import asyncio
 import time
+import httpx
 import requests
-import threading
+import hashlib
+import diskcache
+import ciso8601
+import functools
+from pathlib import Path
 from datetime import datetime, timezone
-from concurrent.futures import ThreadPoolExecutor
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 # Load environment variables
 load_dotenv()
@@ -30,8 +36,74 @@ SCOPES = [
     "https://www.googleapis.com/auth/documents"
 ]
 
-# Serialized doc creation
-doc_creation_lock = threading.Semaphore(1)
+# LLM rate limit: 5 requests/min on the free tier. The limiter handles the
+# quota so job-level concurrency no longer has to.
+llm_limiter = AsyncLimiter(max_rate=int(os.getenv("OPENAI_RPM", "5")), time_period=60)
+
+# Docs quota is 60 write requests/min; each doc costs two writes
+# (create + batchUpdate), so admit 30 docs/min. Token bucket instead of the
+# old Semaphore(1) + sleep(1), which serialized every doc behind a stall.
+docs_limiter = AsyncLimiter(max_rate=30, time_period=60)
+
+# HTTP statuses worth retrying on Google APIs (rate limit / transient server)
+RETRYABLE_STATUSES = (429, 500, 503)
+
+# On-disk LLM response cache: re-runs over overlapping scrape batches (short
+# --days windows) shouldn't pay the LLM again for jobs already processed.
+llm_cache = diskcache.Cache(".cache/llm")
+
+def _bio_version():
+    """
+    bio.txt mtime, folded into the cache key so editing the bio
+    invalidates every cached response.
+    """
+    try:
+        return str(os.path.getmtime("config/bio.txt"))
+    except OSError:
+        return "0"
+
+class _DiscoveryCache:
+    """
+    File-backed cache for Google API discovery documents, so build() reads
+    the several-hundred-KB schema from disk instead of fetching and parsing
+    it over HTTP on every run.
+    """
+    def __init__(self):
+        self.cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "upwork_matcher")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        digest = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"discovery_{digest}.json")
+
+    def get(self, url):
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        try:
+            with open(self._path(url), "w", encoding="utf-8") as f:
+                f.write(content)
+        except OSError:
+            pass
+
+@functools.lru_cache(maxsize=None)
+def _svc(name, version, creds):
+    """
+    Builds (and memoizes) a Google API service object. Repeated calls for
+    the same API reuse the parsed discovery doc and the service instance.
+    """
+    return build(
+        name,
+        version,
+        credentials=creds,
+        static_discovery=False,
+        cache_discovery=True,
+        cache=_DiscoveryCache(),
+    )
 
 def get_google_creds():
     """
@@ -64,64 +136,86 @@ def get_google_creds():
             
     return creds
 
+@functools.lru_cache(maxsize=1)
 def load_bio():
     """
     Loads the user bio from config/bio.txt if it exists.
+    Cached: the bio doesn't change mid-run, no point re-reading it per job.
     """
     if os.path.exists("config/bio.txt"):
         with open("config/bio.txt", "r", encoding="utf-8") as f:
             return f.read().strip()
     return ""
 
-def call_llm(prompt, model_name="gpt-4o-mini"):
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    """
+    One OpenAI client per process. Constructing it per call re-parses env
+    and throws away the warm connection pool; reusing it keeps TLS
+    keep-alive across every completion request.
     """
-    Calls the OpenAI LLM to generate text.
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=httpx.AsyncClient(http2=True, timeout=60))
+
+async def call_llm(prompt, model_name="gpt-4o-mini", response_format=None):
+    """
+    Calls the OpenAI LLM to generate text. Rate-limited by llm_limiter and
+    memoized on disk keyed by (model, bio version, prompt).
     """
     if not OPENAI_API_KEY:
         return "[Error: OPENAI_API_KEY missing]"
 
+    key = hashlib.blake2b(
+        f"{model_name}\0{_bio_version()}\0{prompt}".encode(), digest_size=16
+    ).hexdigest()
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return response.choices[0].message.content.strip()
+        client = _get_client()
+        kwargs = {}
+        if response_format:
+            kwargs["response_format"] = response_format
+        async with llm_limiter:
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                **kwargs
+            )
+        text = response.choices[0].message.content.strip()
+        llm_cache.set(key, text, expire=30 * 86400)
+        return text
     except Exception as e:
+        # Errors are returned but never cached
         print(f"LLM Error: {e}")
         return f"[Error generating content: {e}]"
 
-def generate_cover_letter(job, bio=""):
+async def generate_proposal_pair(job, bio=""):
+    """
+    Generates the cover letter and proposal in ONE request.
+    The job title/description/bio used to be sent twice (once per piece);
+    fusing them halves the LLM round trips and the prompt tokens billed.
+    Returns {"cover_letter": ..., "proposal": ...}.
+    """
     prompt = f"""
-    Write a max 35-word cover letter for this Upwork job.
+    Write application materials for this Upwork job.
     Job: {job.get('title')}
     Description: {job.get('description')}
-    
+
     My Background (Bio):
     {bio}
-    
-    Rules:
+
+    Produce TWO pieces:
+
+    1. "cover_letter" - max 35 words:
     - Mirror the client's problem
     - Reference one concrete relevant build from my bio if applicable
     - Link to walkthrough doc: [DOC_LINK]
     - Do NOT invent fake projects. Only use what is in my bio or general expertise.
-    
-    Output strictly the cover letter text.
-    """
-    return call_llm(prompt)
 
-def generate_proposal_body(job, bio=""):
-    prompt = f"""
-    Write a 200-350 word proposal for this Upwork job.
-    Job: {job.get('title')}
-    Description: {job.get('description')}
-    
-    My Background (Bio):
-    {bio}
-    
-    Rules:
+    2. "proposal" - 200-350 words:
     - First-person, conversational
     - Clear problem mirror
     - Explicit step-by-step plan
@@ -129,66 +223,72 @@ def generate_proposal_body(job, bio=""):
     - Realistic timeline
     - One sharp clarifying question
     - Use my bio to substantiate claims, but do not copy-paste it.
-    
-    Structure:
-    Hey [name]...
-    My approach...
-    Deliverables...
-    Timeline...
-    Question...
+    - Structure: Hey [name]... / My approach... / Deliverables... / Timeline... / Question...
+
+    Respond with a JSON object: {{"cover_letter": "...", "proposal": "..."}}
     """
-    return call_llm(prompt)
+    raw = await call_llm(prompt, response_format={"type": "json_object"})
+    try:
+        pair = orjson.loads(raw)
+        return {
+            "cover_letter": pair.get("cover_letter", ""),
+            "proposal": pair.get("proposal", ""),
+        }
+    except Exception as e:
+        # Model returned an error string or malformed JSON; surface it in both slots.
+        print(f"Failed to parse LLM JSON: {e}")
+        return {"cover_letter": raw, "proposal": raw}
 
 def create_google_doc(service_docs, service_drive, title, content):
     """
     Creates a Google Doc with the given content.
-    Thread-safe with backoff.
+    Rate limiting is handled by docs_limiter at the call site; here we only
+    back off on transient errors (429/500/503) and fail fast on the rest.
     """
     doc_id = None
     doc_url = None
-    
-    with doc_creation_lock:
-        backoff = 1.5
-        for attempt in range(4):
-            try:
-                # Create Doc
-                doc_metadata = {'title': title}
-                doc = service_docs.documents().create(body=doc_metadata).execute()
-                doc_id = doc.get('documentId')
-                
-                # Write Content
-                requests_body = [
-                    {
-                        'insertText': {
-                            'location': {'index': 1},
-                            'text': content
-                        }
+
+    backoff = 1.5
+    for attempt in range(4):
+        try:
+            # Create Doc
+            doc_metadata = {'title': title}
+            doc = service_docs.documents().create(body=doc_metadata).execute()
+            doc_id = doc.get('documentId')
+
+            # Write Content
+            requests_body = [
+                {
+                    'insertText': {
+                        'location': {'index': 1},
+                        'text': content
                     }
-                ]
-                service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests_body}).execute()
-                
-                # Get URL
-                # drive_file = service_drive.files().get(fileId=doc_id, fields='webViewLink').execute()
-                # doc_url = drive_file.get('webViewLink')
-                doc_url = f"https://docs.google.com/document/d/{doc_id}/edit"
-                
-                time.sleep(1) # Rate limit padding
-                break
-                
-            except HttpError as e:
-                print(f"Error creating doc (Attempt {attempt+1}): {e}")
-                time.sleep(backoff)
-                backoff *= 2
-                
+                }
+            ]
+            service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests_body}).execute()
+
+            # Get URL
+            # drive_file = service_drive.files().get(fileId=doc_id, fields='webViewLink').execute()
+            # doc_url = drive_file.get('webViewLink')
+            doc_url = f"https://docs.google.com/document/d/{doc_id}/edit"
+            break
+
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUSES or attempt == 3:
+                raise
+            print(f"Transient error creating doc (Attempt {attempt+1}): {e}")
+            time.sleep(backoff)
+            backoff *= 2
+
     return doc_url
 
-def update_sheet(service_sheets, sheet_id, row_data):
+def update_sheet(service_sheets, sheet_id, rows):
     """
-    Appends a row to the Google Sheet.
+    Appends rows to the Google Sheet in a single request.
     """
     try:
         body = {
-            'values': [row_data]
+            'values': rows
         }
         service_sheets.spreadsheets().values().append(
             spreadsheetId=sheet_id,
@@ -218,28 +318,36 @@ def create_sheet(service_sheets, title="Upwork Proposals"):
         "Proposal Doc", "Status", "Rejection Reason"
     ]
     
-    update_sheet(service_sheets, spreadsheet.get('spreadsheetId'), headers)
+    update_sheet(service_sheets, spreadsheet.get('spreadsheetId'), [headers])
     
     return spreadsheet.get('spreadsheetId')
 
-def process_job(job, services, sheet_id):
+def _format_age(diff):
+    """
+    Human-readable age like '3d ago' / '5h ago' / '12m ago'.
+    """
+    days = diff.days
+    hours = diff.seconds // 3600
+    minutes = (diff.seconds % 3600) // 60
+
+    if days > 0:
+        return f"{days}d ago"
+    if hours > 0:
+        return f"{hours}h ago"
+    return f"{minutes}m ago"
+
+async def process_job(job, services, sheet_id, bio, now_dt):
     """
     Full processing for a single job.
+    Async: the LLM call awaits directly; the (blocking) Google API calls
+    run in worker threads so they don't stall the event loop.
     """
     try:
         print(f"Processing job: {job.get('title')[:30]}...")
-        
-        # Load bio once per process or pass it down? 
-        # Ideally passed in, but for simplicity loading global or in main.
-        # Let's load it inside for thread safety if file read is fast, or better yet, pass it.
-        # Refactoring process_job to accept bio is cleaner.
-        # But for minimal changes, I'll load it here (os cache usually handles it well) or assume it was passed in kwargs?
-        # Actually, let's just call load_bio() here. It's small.
-        bio = load_bio()
-
-        # Generator
-        cl = generate_cover_letter(job, bio)
-        prop = generate_proposal_body(job, bio)
+
+        # Generator (single fused call for both pieces)
+        pair = await generate_proposal_pair(job, bio)
+        cl, prop = pair["cover_letter"], pair["proposal"]
         
         # Google Doc
         doc_title = f"Proposal: {job.get('title')} - {job.get('job_id')}"
@@ -247,12 +355,14 @@ def process_job(job, services, sheet_id):
         
         doc_url = "FALLBACK_TEXT_ONLY"
         try:
-            doc_url = create_google_doc(
-                services['docs'], 
-                services['drive'], 
-                doc_title, 
-                combined_text
-            )
+            async with docs_limiter:
+                doc_url = await asyncio.to_thread(
+                    create_google_doc,
+                    services['docs'],
+                    services['drive'],
+                    doc_title,
+                    combined_text
+                )
         except Exception as e:
             print(f"Failed to create doc for {job.get('job_id')}: {e}")
             
@@ -272,28 +382,21 @@ def process_job(job, services, sheet_id):
         else:
             budget_str = str(budget_raw) if budget_raw else ""
             
-        # Calculate Age
+        # Calculate Age (ciso8601 handles the trailing 'Z' natively and is a
+        # C-level parse; now_dt is computed once per run, not per job)
         posted_date_str = job.get('posted_date')
         age_str = ""
         if posted_date_str:
             try:
-                # Handle ISO format like 2026-01-15T23:58:47.815Z
-                posted_dt = datetime.fromisoformat(posted_date_str.replace("Z", "+00:00"))
-                now_dt = datetime.now(timezone.utc)
-                diff = now_dt - posted_dt
-                
-                days = diff.days
-                seconds = diff.seconds
-                hours = seconds // 3600
-                minutes = (seconds % 3600) // 60
-                
-                if days > 0:
-                    age_str = f"{days}d ago"
-                elif hours > 0:
-                    age_str = f"{hours}h ago"
-                else:
-                    age_str = f"{minutes}m ago"
-            except Exception as e:
+                posted_dt = ciso8601.parse_datetime(posted_date_str)
+                if posted_dt.tzinfo is None:
+                    posted_dt = posted_dt.replace(tzinfo=timezone.utc)
+                age_str = _format_age(now_dt - posted_dt)
+            except (ValueError, TypeError):
+                # ciso8601 raises TypeError on non-string input (the actor
+                # schema is unstable enough that epoch ints show up here);
+                # either way a bad date just means a blank age, not a
+                # failed job.
                 pass
 
         # Prepare Sheet Row
@@ -318,10 +421,7 @@ def process_job(job, services, sheet_id):
             "" 
         ]
         
-        # Update Sheet
-        if sheet_id and sheet_id != "DRY_RUN":
-            update_sheet(services['sheets'], sheet_id, row)
-        
+        # Sheet write happens once at the end of the run (batched in main)
         return {
             "job_id": job.get('job_id'),
             "status": "success",
@@ -333,26 +433,54 @@ def process_job(job, services, sheet_id):
         print(f"Error processing job {job.get('job_id')}: {e}")
         return {"job_id": job.get('job_id'), "status": "failed", "error": str(e)}
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input", required=True, help="Input JSON file with jobs")
-    parser.add_argument("--workers", type=int, default=1, help="Number of worker threads (recommend 1 for 5RPM limit)")
-    parser.add_argument("--sheet-id", help="Existing Google Sheet ID")
-    parser.add_argument("--dry-run", action="store_true", help="Skip Google Sheet creation/updates")
-    parser.add_argument("-o", "--output", help="Output results JSON")
-    
-    args = parser.parse_args()
-    
+async def process_all(jobs, services, sheet_id, bio, max_in_flight):
+    """
+    Runs process_job for every job concurrently on the event loop.
+    The LLM quota is enforced by llm_limiter, so max_in_flight is just a
+    backpressure cap on how many jobs sit in the pipeline at once.
+    """
+    sem = asyncio.Semaphore(max_in_flight)
+    now_dt = datetime.now(timezone.utc)  # one timestamp for the whole run
+
+    async def run_one(job):
+        async with sem:
+            return await process_job(job, services, sheet_id, bio, now_dt)
+
+    # as_completed instead of gather: results land as each job finishes,
+    # so one slow job doesn't stall aggregation, and we get live progress.
+    # One job blowing up must not take down the whole run.
+    tasks = [asyncio.ensure_future(run_one(j)) for j in jobs]
+    results = []
+    for next_done in asyncio.as_completed(tasks):
+        try:
+            res = await next_done
+        except Exception as e:
+            print(f"Job task failed: {e}")
+            res = {"status": "failed", "error": str(e)}
+        results.append(res)
+        print(f"Progress: {len(results)}/{len(tasks)} jobs done")
+    return results
+
+async def main_async(args):
+    """
+    Async entry point: the whole pipeline shares one event loop. Startup
+    work (creds, sheet creation) is one-time and stays synchronous.
+    """
+    # Create output dirs once up front (.tmp holds debug_rows.json)
+    Path(".tmp").mkdir(exist_ok=True)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+
     # Load Jobs
-    with open(args.input, "r", encoding="utf-8") as f:
-        jobs = json.load(f)
-        
-    # Init Google Services
+    with open(args.input, "rb") as f:
+        jobs = orjson.loads(f.read())
+
+    # Init Google Services (memoized; discovery docs come from disk cache)
     creds = get_google_creds()
     services = {
-        'sheets': build('sheets', 'v4', credentials=creds),
-        'docs': build('docs', 'v1', credentials=creds),
-        'drive': build('drive', 'v3', credentials=creds)
+        'sheets': _svc('sheets', 'v4', creds),
+        'docs': _svc('docs', 'v1', creds),
+        'drive': _svc('drive', 'v3', creds)
     }
     
     # Setup Sheet
@@ -364,30 +492,46 @@ def main():
         sheet_id = create_sheet(services['sheets'])
         print(f"Created new Sheet: https://docs.google.com/spreadsheets/d/{sheet_id}")
     
-    # Process Pool
-    results = []
-    all_rows = []
-    
-    print(f"Starting processing with {args.workers} workers.")
-    
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        futures = {executor.submit(process_job, job, services, sheet_id): job for job in jobs}
-        
-        for future in futures:
-            res = future.result()
-            results.append(res)
-            if 'row_data' in res:
-                all_rows.append(res['row_data'])
+    print(f"Starting processing with up to {args.workers} jobs in flight.")
+
+    # Load the bio once up front and hand it to every worker.
+    bio = load_bio()
+
+    results = await process_all(jobs, services, sheet_id, bio, args.workers)
+    del jobs  # raw job dicts aren't needed past this point; free them early
+
+    # Derive rows from results once at the end instead of keeping a second
+    # list in sync during processing.
+    all_rows = [res['row_data'] for res in results if 'row_data' in res]
+
+    # Flush all rows in ONE append instead of a round trip per job.
+    # (append rather than values.batchUpdate so we extend below the header
+    # row instead of overwriting from A1.)
+    if all_rows and sheet_id and sheet_id != "DRY_RUN":
+        await asyncio.to_thread(update_sheet, services['sheets'], sheet_id, all_rows)
+        print(f"Appended {len(all_rows)} rows to sheet.")
 
     # Save Debug Rows
-    with open(".tmp/debug_rows.json", "w", encoding="utf-8") as f:
-        json.dump(all_rows, f, indent=2)
+    with open(".tmp/debug_rows.json", "wb") as f:
+        f.write(orjson.dumps(all_rows, option=orjson.OPT_INDENT_2))
     print(f"Saved {len(all_rows)} rows to .tmp/debug_rows.json for inspection.")
 
     # Save Results
     if args.output:
-        with open(args.output, "w", encoding="utf-8") as f:
-            json.dump(results, f, indent=2)
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", required=True, help="Input JSON file with jobs")
+    parser.add_argument("--workers", type=int, default=5, help="Max jobs in flight (LLM rate limit is enforced separately)")
+    parser.add_argument("--sheet-id", help="Existing Google Sheet ID")
+    parser.add_argument("--dry-run", action="store_true", help="Skip Google Sheet creation/updates")
+    parser.add_argument("-o", "--output", help="Output results JSON")
+
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args))
 
 if __name__ == "__main__":
     main()